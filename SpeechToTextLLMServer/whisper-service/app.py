@@ -1,22 +1,59 @@
 # whisper-service/app.py
+import os
+
+# Let CTranslate2's CUDA caching allocator keep blocks up to 256MB (default 16MB),
+# so batched decoder KV caches are reused across requests instead of being
+# cudaMalloc'd and freed on every decode. Set before ctranslate2 is imported:
+# the allocator reads it once, when it is first created
+os.environ.setdefault("CT2_CUDA_CACHING_ALLOCATOR_CONFIG", "4,3,14,1073741824")
+
 from fastapi import FastAPI, UploadFile, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
-import whisper
+from fastapi.responses import ORJSONResponse
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.transcribe import Segment, get_compression_ratio, get_suppressed_tokens
+from faster_whisper.vad import VadOptions, collect_chunks, get_speech_timestamps
+from transformers import AutoTokenizer
+import ctranslate2
 import torch
-import tempfile
-import os
+import numpy as np
 import asyncio
-from typing import Optional, List
+from typing import Optional, List, Dict, Literal, Tuple, Union
 import logging
+import re
 from pydantic import BaseModel
-import redis
-import json
-import hashlib
+from redis import asyncio as aioredis
+import orjson
+import blake3
+import xxhash
 import time
 import io
+import tempfile
+import shutil
+from dataclasses import asdict, dataclass
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="Whisper Translation & Transcription Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the models before serving, and flush pending cache writes on shutdown"""
+    
+    global window_queue
+    
+    warm_up_models()
+    window_queue = asyncio.Queue()
+    batch_worker = asyncio.create_task(run_window_batches())
+    yield
+    batch_worker.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+app = FastAPI(
+    title="Whisper Translation & Transcription Service",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,35 +64,147 @@ app.add_middleware(
 )
 
 # Configuration
-MODEL_SIZE = os.getenv("MODEL_SIZE", "base")
+MODEL_SIZE = os.getenv("MODEL_SIZE", "base")  # Size name or path to a CTranslate2 model directory
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-COMPUTE_TYPE = os.getenv("COMPUTE_TYPE", "float16")
+QUANTIZATION = os.getenv("QUANTIZATION", "int8_fp16" if DEVICE == "cuda" else "int8")
 MAX_WORKERS = int(os.getenv("WORKERS", "4"))
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))  # 0 = CTranslate2 default
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))  # Audio chunks per batched decode on GPU
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "20"))  # How long short requests wait to share a batch
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))  # Short requests decoded together in one pass
+# Ampere+ GPUs only. The PyPI ctranslate2 wheels are built without the flash
+# attention kernels, so this also needs CTranslate2 built with WITH_FLASH_ATTN=ON
+FLASH_ATTENTION = os.getenv("FLASH_ATTENTION", "false").lower() == "true"
+MAX_UPLOAD_SIZE = 25 * 1024 * 1024  # 25MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_AUDIO_LENGTH = int(os.getenv("MAX_AUDIO_LENGTH", "600"))  # Seconds of decoded audio
+MAX_CACHED_PCM_SIZE = int(os.getenv("MAX_CACHED_PCM_SIZE", str(2 * 1024 * 1024)))  # ~65s of PCM
+SAMPLE_RATE = 16000
+TRANSLATION_MODEL_PATH = os.getenv("TRANSLATION_MODEL_PATH", "/models/nllb-200-distilled-600M-int8")
+
+# CTranslate2 compute type for each QUANTIZATION setting
+COMPUTE_TYPES = {
+    "fp16": "float16",
+    "int8": "int8",
+    "int8_fp16": "int8_float16"
+}
+
+if QUANTIZATION not in COMPUTE_TYPES:
+    raise ValueError(f"Unknown QUANTIZATION: {QUANTIZATION} (expected one of {', '.join(COMPUTE_TYPES)})")
+
+# fp16 types only exist on GPUs, so e.g. compose's int8_fp16 on a CPU host falls back to int8
+COMPUTE_TYPE = COMPUTE_TYPES[QUANTIZATION]
+SUPPORTED_COMPUTE_TYPES = ctranslate2.get_supported_compute_types(DEVICE)
+if COMPUTE_TYPE not in SUPPORTED_COMPUTE_TYPES:
+    if "int8" not in SUPPORTED_COMPUTE_TYPES:
+        raise ValueError(
+            f"QUANTIZATION {QUANTIZATION} is not supported on {DEVICE} "
+            f"(supported compute types: {', '.join(sorted(SUPPORTED_COMPUTE_TYPES))})"
+        )
+    logging.warning(f"QUANTIZATION {QUANTIZATION} is not supported on {DEVICE}, falling back to int8")
+    QUANTIZATION, COMPUTE_TYPE = "int8", "int8"
+
+# NLLB-200 (FLORES-200) codes for the languages Whisper can detect
+NLLB_LANGUAGE_CODES = {
+    "af": "afr_Latn", "am": "amh_Ethi", "ar": "arb_Arab", "as": "asm_Beng",
+    "az": "azj_Latn", "ba": "bak_Cyrl", "be": "bel_Cyrl", "bg": "bul_Cyrl",
+    "bn": "ben_Beng", "bo": "bod_Tibt", "bs": "bos_Latn", "ca": "cat_Latn",
+    "cs": "ces_Latn", "cy": "cym_Latn", "da": "dan_Latn", "de": "deu_Latn",
+    "el": "ell_Grek", "en": "eng_Latn", "es": "spa_Latn", "et": "est_Latn",
+    "eu": "eus_Latn", "fa": "pes_Arab", "fi": "fin_Latn", "fo": "fao_Latn",
+    "fr": "fra_Latn", "gl": "glg_Latn", "gu": "guj_Gujr", "ha": "hau_Latn",
+    "he": "heb_Hebr", "hi": "hin_Deva", "hr": "hrv_Latn", "ht": "hat_Latn",
+    "hu": "hun_Latn", "hy": "hye_Armn", "id": "ind_Latn", "is": "isl_Latn",
+    "it": "ita_Latn", "ja": "jpn_Jpan", "jw": "jav_Latn", "ka": "kat_Geor",
+    "kk": "kaz_Cyrl", "km": "khm_Khmr", "kn": "kan_Knda", "ko": "kor_Hang",
+    "lb": "ltz_Latn", "ln": "lin_Latn", "lo": "lao_Laoo", "lt": "lit_Latn",
+    "lv": "lvs_Latn", "mg": "plt_Latn", "mi": "mri_Latn", "mk": "mkd_Cyrl",
+    "ml": "mal_Mlym", "mn": "khk_Cyrl", "mr": "mar_Deva", "ms": "zsm_Latn",
+    "mt": "mlt_Latn", "my": "mya_Mymr", "ne": "npi_Deva", "nl": "nld_Latn",
+    "nn": "nno_Latn", "no": "nob_Latn", "oc": "oci_Latn", "pa": "pan_Guru",
+    "pl": "pol_Latn", "ps": "pbt_Arab", "pt": "por_Latn", "ro": "ron_Latn",
+    "ru": "rus_Cyrl", "sa": "san_Deva", "sd": "snd_Arab", "si": "sin_Sinh",
+    "sk": "slk_Latn", "sl": "slv_Latn", "sn": "sna_Latn", "so": "som_Latn",
+    "sq": "als_Latn", "sr": "srp_Cyrl", "su": "sun_Latn", "sv": "swe_Latn",
+    "sw": "swh_Latn", "ta": "tam_Taml", "te": "tel_Telu", "tg": "tgk_Cyrl",
+    "th": "tha_Thai", "tk": "tuk_Latn", "tl": "tgl_Latn", "tr": "tur_Latn",
+    "tt": "tat_Cyrl", "uk": "ukr_Cyrl", "ur": "urd_Arab", "uz": "uzn_Latn",
+    "vi": "vie_Latn", "yi": "ydd_Hebr", "yo": "yor_Latn", "zh": "zho_Hans",
+    "zh-tw": "zho_Hant", "yue": "yue_Hant"
+}
+
+# Translate sentence by sentence so long transcripts stay within the model context.
+# CJK full stops are not followed by a space, so split right after them
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])")
+# NLLB-200 was trained on sequences of at most 512 tokens
+MAX_TRANSLATION_TOKENS = 512
 
 # Initialize Redis
-redis_client = redis.Redis(host='redis', port=6379, db=0, decode_responses=True)
+redis_client = aioredis.Redis(host='redis', port=6379, db=0, decode_responses=True)
+# Binary handle for decoded audio buffers
+redis_binary_client = aioredis.Redis(host='redis', port=6379, db=0, decode_responses=False)
+
+# Keep references to in-flight cache writes so they are not garbage collected
+background_tasks = set()
 
-# Load Whisper model
-print(f"Loading Whisper model: {MODEL_SIZE} on {DEVICE}")
-if DEVICE == "cuda":
-    model = whisper.load_model(MODEL_SIZE, device=DEVICE)
+# On CPU, split the CPU_THREADS budget across the replicas instead of giving each
+# replica all of it (e.g. k8s: 2 threads -> 2 replicas x 1 thread, not 4 x 2)
+if DEVICE == "cpu" and CPU_THREADS:
+    WHISPER_REPLICAS = min(MAX_WORKERS, CPU_THREADS)
+    WHISPER_CPU_THREADS = CPU_THREADS // WHISPER_REPLICAS
 else:
-    model = whisper.load_model(MODEL_SIZE)
+    WHISPER_REPLICAS, WHISPER_CPU_THREADS = MAX_WORKERS, CPU_THREADS
+
+# Load Whisper model (CTranslate2 backend, weights quantized at load time)
+print(f"Loading Whisper model: {MODEL_SIZE} on {DEVICE} ({QUANTIZATION})")
+model = WhisperModel(
+    MODEL_SIZE,
+    device=DEVICE,
+    compute_type=COMPUTE_TYPE,
+    cpu_threads=WHISPER_CPU_THREADS,
+    num_workers=WHISPER_REPLICAS,  # Model replicas, so requests decode in parallel
+    flash_attention=FLASH_ATTENTION and DEVICE == "cuda"
+)
+
+# On GPU, decode the VAD chunks of a long upload as one batch instead of one
+# 30s window at a time. This only batches within a file; single-window requests
+# (the extension's chunks) are batched across requests by run_window_batches
+batched_model = BatchedInferencePipeline(model=model) if DEVICE == "cuda" else None
+
+# Load NLLB-200 for text translation (converted to CTranslate2 in the Docker build)
+print(f"Loading translation model: {TRANSLATION_MODEL_PATH} on {DEVICE} ({QUANTIZATION})")
+translator = ctranslate2.Translator(
+    TRANSLATION_MODEL_PATH,
+    device=DEVICE,
+    compute_type=COMPUTE_TYPE,
+    intra_threads=CPU_THREADS
+)
+translation_tokenizer = AutoTokenizer.from_pretrained(TRANSLATION_MODEL_PATH)
 
 # Thread pool for CPU-bound operations
 executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
+# Requests that fit in one 30s window (the extension's chunks) are queued here and
+# decoded together across requests; created by the lifespan handler
+window_queue: Optional[asyncio.Queue] = None
+
+# Same speech detection settings BatchedInferencePipeline uses
+WINDOW_VAD_OPTIONS = VadOptions(max_speech_duration_s=30, min_silence_duration_ms=160)
+
 class TranscriptionRequest(BaseModel):
     source_language: Optional[str] = None  # Auto-detect if None
     target_language: str = "en"  # Default to English
     task: str = "transcribe"  # "transcribe" or "translate"
     return_segments: bool = False
+    segments_format: str = "soa"  # "soa" (columnar) or "aos" (legacy list of dicts)
     return_language: bool = True
 
 class TranslationRequest(BaseModel):
     source_language: Optional[str] = None  # Auto-detect if None
     target_language: str = "en"  # Whisper can only translate TO English
+    task: str = "translate"
     return_segments: bool = False
+    segments_format: str = "soa"  # "soa" (columnar) or "aos" (legacy list of dicts)
     return_language: bool = True
 
 class TextTranslationRequest(BaseModel):
@@ -63,120 +212,529 @@ class TextTranslationRequest(BaseModel):
     source_language: str
     target_language: str
 
+# Documents the audio endpoints' response; handlers return the trusted dict
+# from process_audio_sync directly instead of validating it through this model
 class WhisperResponse(BaseModel):
     text: str
     detected_language: Optional[str] = None
-    segments: Optional[List[dict]] = None
+    segments: Optional[List[dict]] = None  # Deprecated, only with segments_format="aos"
+    segments_soa: Optional[Dict[str, list]] = None  # numpy columns serialize as JSON arrays
     processing_time: float
     task: str
 
-def process_audio_sync(audio_path: str, task: str, source_lang: Optional[str] = None, 
-                      target_lang: str = "en", return_segments: bool = False) -> dict:
-    """Synchronous audio processing function"""
+# Per-segment fields returned in the columnar segments_soa layout, with the
+# array dtype of each numeric column (None keeps a plain list)
+SEGMENT_COLUMNS = {
+    "id": np.int32, "start": np.float32, "end": np.float32, "text": None, "tokens": None,
+    "avg_logprob": np.float32, "compression_ratio": np.float32,
+    "no_speech_prob": np.float32, "temperature": np.float32
+}
+
+async def _write_cache(client: aioredis.Redis, entries: dict, ttl: int) -> None:
+    """Write all entries in a single pipelined round trip"""
+    
+    try:
+        pipe = client.pipeline(transaction=False)
+        for key, value in entries.items():
+            pipe.setex(key, ttl, value)
+        await pipe.execute()
+        
+    except Exception as e:
+        logging.error(f"Cache write error: {str(e)}")
+
+def cache_in_background(client: aioredis.Redis, entries: dict, ttl: int = 3600) -> None:
+    """Schedule a cache write without making the response wait for it"""
+    
+    task = asyncio.create_task(_write_cache(client, entries, ttl))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def hash_upload(audio_file: UploadFile) -> Tuple[str, bool]:
+    """Hash the upload chunk by chunk, enforcing the size limit as it is read"""
+    
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    total_size = 0
+    # Spot MP4/MOV (ftyp box first) here, so the decode pass can stream
+    # straight into ffmpeg without peeking at the upload again
+    is_mp4 = False
+    
+    while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+        if total_size == 0:
+            is_mp4 = chunk[4:8] == b"ftyp"
+        total_size += len(chunk)
+        if total_size > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail="File too large (max 25MB)")
+        hasher.update(chunk)
+    
+    return hasher.hexdigest(), is_mp4
+
+async def run_ffmpeg(source: str, audio_file: Optional[UploadFile] = None) -> bytes:
+    """Decode source to 16kHz mono 16-bit PCM, streaming audio_file to stdin when source is pipe:0"""
+    
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-loglevel", "error",
+        "-threads", "0",
+        "-i", source,
+        "-t", str(MAX_AUDIO_LENGTH + 1),  # Enough to tell an over-long file without decoding all of it
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(SAMPLE_RATE),
+        "pipe:1",
+        stdin=asyncio.subprocess.PIPE if audio_file is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    
+    # Drain ffmpeg's output while feeding it so neither pipe can fill up
+    reads = [asyncio.ensure_future(process.stdout.read()), asyncio.ensure_future(process.stderr.read())]
+    
+    try:
+        if audio_file is not None:
+            await audio_file.seek(0)
+            try:
+                while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg exited early; its stderr says why
+            finally:
+                process.stdin.close()
+        
+        pcm, stderr = await asyncio.gather(*reads)
+        await process.wait()
+        
+    finally:
+        # On cancellation (client disconnected) or error, don't leave ffmpeg
+        # running. Drain its pipes too: wait() alone blocks until they close
+        if process.returncode is None:
+            process.kill()
+            for read in reads:
+                read.cancel()
+            await asyncio.wait(reads)
+            await process.communicate()
+    
+    if process.returncode != 0:
+        raise HTTPException(status_code=400, detail=f"Failed to decode audio: {stderr.decode().strip()}")
+    
+    return pcm
+
+def spool_upload(audio_file: UploadFile) -> tempfile.NamedTemporaryFile:
+    """Copy the upload to a named temporary file ffmpeg can seek in"""
+    
+    source = tempfile.NamedTemporaryFile(suffix=os.path.splitext(audio_file.filename or "")[1])
+    audio_file.file.seek(0)
+    shutil.copyfileobj(audio_file.file, source, UPLOAD_CHUNK_SIZE)
+    source.flush()
+    
+    return source
+
+async def decode_upload(audio_file: UploadFile, is_mp4: bool = False) -> bytes:
+    """Decode the upload with ffmpeg, returning 16kHz mono 16-bit PCM"""
+    
+    # MP4/MOV files may keep the moov atom after the media data, which ffmpeg
+    # can't reach without seeking
+    pcm = b"" if is_mp4 else await run_ffmpeg("pipe:0", audio_file)
+    
+    # Everything else streams through stdin; spool to disk only for MP4, or
+    # as a retry when a container decodes to nothing from a pipe
+    if not pcm:
+        loop = asyncio.get_event_loop()
+        source = await loop.run_in_executor(None, spool_upload, audio_file)
+        try:
+            pcm = await run_ffmpeg(source.name)
+        finally:
+            source.close()
+    
+    if not pcm:
+        raise HTTPException(status_code=400, detail="No audio found in upload")
+    
+    return pcm
+
+async def _get_audio(content_hash: str, audio_file: UploadFile, is_mp4: bool = False) -> np.ndarray:
+    """Load decoded 16kHz mono audio from cache, decoding the upload on a miss"""
+    
+    cache_key = f"pcm:{content_hash}"
+    
+    pcm = await redis_binary_client.get(cache_key)
+    if not pcm:
+        pcm = await decode_upload(audio_file, is_mp4)
+        
+        if len(pcm) > MAX_AUDIO_LENGTH * SAMPLE_RATE * 2:
+            raise HTTPException(status_code=413, detail=f"Audio too long (max {MAX_AUDIO_LENGTH}s)")
+        
+        # Cache for 1 hour, shared by every task on the same audio. Long files
+        # are cheaper to decode again than to keep in Redis
+        if len(pcm) <= MAX_CACHED_PCM_SIZE:
+            cache_in_background(redis_binary_client, {cache_key: pcm})
+    
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+def segments_to_columns(segments: list) -> Dict[str, Union[list, np.ndarray]]:
+    """Convert segments to struct-of-arrays form: one array per field instead of one dict per segment"""
+    
+    columns = {}
+    for column, dtype in SEGMENT_COLUMNS.items():
+        values = [getattr(segment, column) for segment in segments]
+        columns[column] = values if dtype is None else np.array(values, dtype=dtype)
+    
+    return columns
+
+def _whisper_task(task: str) -> str:
+    """Map an endpoint task to the task Whisper runs"""
+    
+    if task == "transcribe":
+        # Transcribe in original language
+        return "transcribe"
+        
+    elif task == "translate":
+        # Translate to English (Whisper's built-in translation)
+        return "translate"
+        
+    elif task == "translate_to_language":
+        # For non-English targets, we need to transcribe first then translate
+        # This is a limitation - Whisper only translates TO English
+        return "transcribe"
+        
+    raise ValueError(f"Unknown task: {task}")
+
+def build_response(segments: List[Segment], language: Optional[str], task: str,
+                   processing_time: float, return_segments: bool = False,
+                   segments_format: str = "soa") -> dict:
+    """Assemble the audio endpoints' response from decoded segments"""
+    
+    response_data = {
+        "text": "".join(segment.text for segment in segments).strip(),
+        "detected_language": language,
+        "processing_time": processing_time,
+        "task": task
+    }
+    
+    if return_segments:
+        if segments_format == "aos":
+            response_data["segments"] = [asdict(segment) for segment in segments]
+        else:
+            response_data["segments_soa"] = segments_to_columns(segments)
+        
+    return response_data
+
+def process_audio_sync(audio: np.ndarray, task: str, source_lang: Optional[str] = None, 
+                      target_lang: str = "en", return_segments: bool = False,
+                      segments_format: str = "soa") -> dict:
+    """Synchronous audio processing function, used for audio longer than one window"""
     
     start_time = time.time()
     
     try:
-        if task == "transcribe":
-            # Transcribe in original language
-            result = model.transcribe(
-                audio_path,
+        whisper_task = _whisper_task(task)
+        
+        if batched_model is not None:
+            segments, info = batched_model.transcribe(
+                audio,
                 language=source_lang,  # None for auto-detect
-                task="transcribe",
-                fp16=DEVICE == "cuda",
-                verbose=False
+                task=whisper_task,
+                beam_size=1,
+                vad_filter=True,
+                batch_size=BATCH_SIZE
             )
-            
-        elif task == "translate":
-            # Translate to English (Whisper's built-in translation)
-            result = model.transcribe(
-                audio_path,
+        else:
+            segments, info = model.transcribe(
+                audio,
                 language=source_lang,  # None for auto-detect
-                task="translate",  # This translates to English
-                fp16=DEVICE == "cuda",
-                verbose=False
+                task=whisper_task,
+                beam_size=1,
+                vad_filter=True
             )
-            
-        elif task == "translate_to_language":
-            # For non-English targets, we need to transcribe first then translate
-            # This is a limitation - Whisper only translates TO English
-            result = model.transcribe(
-                audio_path,
-                language=source_lang,
-                task="transcribe",
-                fp16=DEVICE == "cuda",
-                verbose=False
-            )
-            
-        else:
-            raise ValueError(f"Unknown task: {task}")
-            
-        processing_time = time.time() - start_time
+        # Segments are generated lazily; decoding happens while iterating
+        segments = list(segments)
         
-        response_data = {
-            "text": result["text"].strip(),
-            "detected_language": result.get("language"),
-            "processing_time": processing_time,
-            "task": task
-        }
-        
-        if return_segments:
-            response_data["segments"] = result.get("segments", [])
-            
-        return response_data
+        return build_response(
+            segments, info.language, task, time.time() - start_time,
+            return_segments, segments_format
+        )
         
     except Exception as e:
         logging.error(f"Whisper processing error: {str(e)}")
         raise
 
-async def process_audio_async(audio_file: UploadFile, request: TranscriptionRequest) -> WhisperResponse:
-    """Async wrapper for audio processing"""
+@dataclass
+class WindowRequest:
+    features: np.ndarray  # Padded log-Mel features of one 30s window
+    language: Optional[str]  # None for auto-detect
+    task: str  # Whisper task
+    duration: float
+    future: asyncio.Future
+
+def prepare_window(audio: np.ndarray) -> Optional[np.ndarray]:
+    """Drop non-speech from a single-window clip and compute its encoder input, or None if it has no speech"""
     
-    # Read audio content
-    content = await audio_file.read()
+    speech = get_speech_timestamps(audio, WINDOW_VAD_OPTIONS)
+    if not speech:
+        return None
     
-    # Create cache key
-    cache_key = f"whisper:{hashlib.md5(content).hexdigest()}:{request.source_language}:{request.target_language}:{request.task}"
+    audio_chunks, _ = collect_chunks(audio, speech)
+    return pad_or_trim(model.feature_extractor(np.concatenate(audio_chunks))[..., :-1])
+
+def decode_window_batch(requests: List[WindowRequest]) -> List[Tuple[List[Segment], str]]:
+    """Run one encoder and one greedy decoder pass over windows from different requests"""
     
-    # Check cache
-    cached_result = redis_client.get(cache_key)
-    if cached_result:
-        return WhisperResponse(**json.loads(cached_result))
+    encoder_output = model.encode(np.stack([request.features for request in requests]))
     
-    # Save to temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-        tmp_file.write(content)
-        tmp_file_path = tmp_file.name
+    # Each item gets its own language token, so mixed-language batches decode correctly
+    detected = [None] * len(requests)
+    if model.model.is_multilingual and any(request.language is None for request in requests):
+        detected = [
+            languages[0][0][2:-2]  # "<|fr|>" -> "fr"
+            for languages in model.model.detect_language(encoder_output)
+        ]
     
-    try:
-        # Process in thread pool
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            executor,
-            process_audio_sync,
-            tmp_file_path,
-            request.task,
-            request.source_language,
-            request.target_language,
-            request.return_segments
+    item_tokenizers = [
+        Tokenizer(
+            model.hf_tokenizer,
+            model.model.is_multilingual,
+            task=request.task,
+            language=request.language or detected[i] or "en"
         )
+        for i, request in enumerate(requests)
+    ]
+    
+    results = model.model.generate(
+        encoder_output,
+        [model.get_prompt(tokenizer, [], without_timestamps=True) for tokenizer in item_tokenizers],
+        beam_size=1,
+        max_length=model.max_length,
+        return_scores=True,
+        return_no_speech_prob=True,
+        suppress_blank=True,
+        # The suppressed set doesn't depend on the language or task token
+        suppress_tokens=get_suppressed_tokens(item_tokenizers[0], [-1])
+    )
+    
+    outputs = []
+    for request, tokenizer, result in zip(requests, item_tokenizers, results):
+        tokens = result.sequences_ids[0]
+        text = tokenizer.decode(tokens)
+        segment = Segment(
+            id=1,
+            seek=0,
+            start=0.0,
+            end=round(request.duration, 3),
+            text=text,
+            tokens=tokens,
+            # Scores are length-normalized; recover the average log prob like faster-whisper does
+            avg_logprob=result.scores[0] * len(tokens) / (len(tokens) + 1),
+            compression_ratio=get_compression_ratio(text),
+            no_speech_prob=result.no_speech_prob,
+            words=None,
+            temperature=0.0
+        )
+        outputs.append(([segment], tokenizer.language_code))
+    
+    return outputs
+
+async def run_window_batches():
+    """Decode queued windows in batches of up to MAX_BATCH, collected over BATCH_WINDOW_MS"""
+    
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        batch = [await window_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_MS / 1000
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(window_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
         
-        response = WhisperResponse(**result)
+        # Skip requests whose client already went away
+        batch = [request for request in batch if not request.future.done()]
+        if not batch:
+            continue
         
-        # Cache for 1 hour
-        redis_client.setex(cache_key, 3600, json.dumps(response.dict()))
+        try:
+            outputs = await loop.run_in_executor(executor, decode_window_batch, batch)
+            
+        except Exception as e:
+            logging.error(f"Whisper batch error: {str(e)}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            continue
         
-        return response
+        for request, output in zip(batch, outputs):
+            if not request.future.done():
+                request.future.set_result(output)
+
+async def run_whisper(audio: np.ndarray, task: str, source_lang: Optional[str] = None,
+                      target_lang: str = "en", return_segments: bool = False,
+                      segments_format: str = "soa") -> dict:
+    """Decode single-window audio through the cross-request batch queue, longer audio in the thread pool"""
+    
+    loop = asyncio.get_event_loop()
+    
+    if window_queue is None or len(audio) > model.feature_extractor.n_samples:
+        return await loop.run_in_executor(
+            executor,
+            process_audio_sync,
+            audio,
+            task,
+            source_lang,
+            target_lang,
+            return_segments,
+            segments_format
+        )
+    
+    start_time = time.time()
+    whisper_task = _whisper_task(task)
+    
+    # Reject bad input here so it can't fail the whole batch it would join
+    if source_lang is not None and source_lang not in model.supported_languages:
+        raise HTTPException(status_code=400, detail=f"Unsupported language: {source_lang}")
+    
+    features = await loop.run_in_executor(executor, prepare_window, audio)
+    if features is None:
+        # No speech, nothing to decode
+        segments, language = [], source_lang
+    else:
+        future = loop.create_future()
+        await window_queue.put(WindowRequest(features, source_lang, whisper_task, len(audio) / SAMPLE_RATE, future))
+        segments, language = await future
+    
+    return build_response(
+        segments, language, task, time.time() - start_time,
+        return_segments, segments_format
+    )
+
+def _nllb_code(language: str) -> str:
+    """Map an ISO 639-1 code (e.g. "fr", "zh-TW") to its NLLB-200 code"""
+    
+    language = language.lower()
+    code = NLLB_LANGUAGE_CODES.get(language) or NLLB_LANGUAGE_CODES.get(language.split("-")[0])
+    if code is None:
+        raise ValueError(f"Unsupported translation language: {language}")
+    
+    return code
+
+def check_translation_languages(source_lang: Optional[str], target_lang: str) -> None:
+    """Reject languages NLLB-200 has no code for before doing any work"""
+    
+    try:
+        if source_lang and source_lang != "auto":
+            _nllb_code(source_lang)
+        _nllb_code(target_lang)
         
-    finally:
-        # Clean up
-        os.unlink(tmp_file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def translate_text_sync(text: str, source_lang: Optional[str], target_lang: str) -> str:
+    """Synchronous text translation with the local NLLB-200 model"""
+    
+    # NLLB has no language detection; it copes with a wrong source token far
+    # better than a missing one, so fall back to English for auto-detect
+    if not source_lang or source_lang == "auto":
+        source_lang = "en"
+    
+    source_code = _nllb_code(source_lang)
+    target_code = _nllb_code(target_lang)
+    
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY.split(text.strip()) if sentence]
+    if not sentences:
+        return ""
+    
+    # Split run-on sentences (e.g. unpunctuated transcripts) into windows
+    # that fit the model, leaving room for the language token and </s>
+    window = MAX_TRANSLATION_TOKENS - 2
+    pieces = []
+    for sentence in sentences:
+        tokens = translation_tokenizer.tokenize(sentence)
+        pieces.extend(tokens[i:i + window] for i in range(0, len(tokens), window))
+    
+    # Translate all pieces in one batch
+    batch = [[source_code] + piece + ["</s>"] for piece in pieces]
+    results = translator.translate_batch(
+        batch,
+        target_prefix=[[target_code]] * len(batch),
+        max_input_length=MAX_TRANSLATION_TOKENS,
+        max_decoding_length=MAX_TRANSLATION_TOKENS
+    )
+    
+    # Drop the target language token from each hypothesis
+    return " ".join(
+        translation_tokenizer.decode(
+            translation_tokenizer.convert_tokens_to_ids(result.hypotheses[0][1:]),
+            skip_special_tokens=True
+        )
+        for result in results
+    )
+
+def warm_up_models():
+    """Run both models once so the first request doesn't pay CUDA/allocator initialization"""
+    
+    print("Warming up models")
+    
+    # One second of silence; VAD is off so the decoder actually runs
+    whisper_model = batched_model if batched_model is not None else model
+    segments, _ = whisper_model.transcribe(
+        np.zeros(16000, dtype=np.float32),
+        beam_size=1,
+        vad_filter=False
+    )
+    list(segments)
+    
+    translate_text_sync("Hello.", "en", "fr")
 
-@app.post("/transcribe", response_model=WhisperResponse)
+async def process_audio_async(audio_file: UploadFile, request: TranscriptionRequest) -> dict:
+    """Async wrapper for audio processing"""
+    
+    # Hash the upload without buffering it in memory
+    content_hash, is_mp4 = await hash_upload(audio_file)
+    
+    # Clients send "" or "auto" for auto-detect; normalize so all of them share one cache entry
+    source_language = request.source_language if request.source_language not in ("", "auto") else None
+    
+    # Create cache key
+    segments_key = request.segments_format if request.return_segments else "none"
+    cache_key = f"whisper:{content_hash}:{source_language or 'auto'}:{request.target_language}:{request.task}:{segments_key}"
+    
+    # Check cache
+    cached_result = await redis_client.get(cache_key)
+    if cached_result:
+        return orjson.loads(cached_result)
+    
+    # Process in thread pool
+    audio = await _get_audio(content_hash, audio_file, is_mp4)
+    result = await run_whisper(
+        audio,
+        request.task,
+        source_language,
+        request.target_language,
+        request.return_segments,
+        request.segments_format
+    )
+    
+    # ORJSONResponse serializes numpy arrays too, so cached and fresh bodies match
+    cache_entries = {cache_key: orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY)}
+    
+    # Also cache under the detected language so explicit-language requests hit too
+    if source_language is None and result["detected_language"]:
+        alias_key = f"whisper:{content_hash}:{result['detected_language']}:{request.target_language}:{request.task}:{segments_key}"
+        cache_entries[alias_key] = cache_entries[cache_key]
+    
+    # Cache for 1 hour
+    cache_in_background(redis_client, cache_entries)
+    
+    return result
+
+@app.post("/transcribe", response_model=None, responses={200: {"model": WhisperResponse}})
 async def transcribe_audio(
     audio_file: UploadFile,
     source_language: Optional[str] = Form(None),
     return_segments: bool = Form(False),
+    segments_format: Literal["soa", "aos"] = Form("soa"),
     return_language: bool = Form(True)
 ):
     """Transcribe audio in original language"""
@@ -184,25 +742,23 @@ async def transcribe_audio(
     if not audio_file:
         raise HTTPException(status_code=400, detail="No audio file provided")
     
-    # Validate file size (max 25MB)
-    if audio_file.size > 25 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large (max 25MB)")
-    
     request = TranscriptionRequest(
         source_language=source_language,
         task="transcribe",
         return_segments=return_segments,
+        segments_format=segments_format,
         return_language=return_language
     )
     
-    return await process_audio_async(audio_file, request)
+    return ORJSONResponse(await process_audio_async(audio_file, request))
 
-@app.post("/translate", response_model=WhisperResponse)
+@app.post("/translate", response_model=None, responses={200: {"model": WhisperResponse}})
 async def translate_audio(
     audio_file: UploadFile,
     source_language: Optional[str] = Form(None),
     target_language: str = Form("en"),
     return_segments: bool = Form(False),
+    segments_format: Literal["soa", "aos"] = Form("soa"),
     return_language: bool = Form(True)
 ):
     """Translate audio to English (Whisper's built-in capability)"""
@@ -220,49 +776,51 @@ async def translate_audio(
         source_language=source_language,
         target_language=target_language,
         return_segments=return_segments,
+        segments_format=segments_format,
         return_language=return_language
     )
     
-    return await process_audio_async(audio_file, request)
+    return ORJSONResponse(await process_audio_async(audio_file, request))
 
 @app.post("/translate_text")
 async def translate_text(request: TextTranslationRequest):
-    """Text translation using lightweight translation library"""
+    """Text translation using the local NLLB-200 model"""
+    
+    check_translation_languages(request.source_language, request.target_language)
     
     try:
-        # Use lightweight translation library
-        from googletrans import Translator
-        translator = Translator()
-        
         # Create cache key for text translation
-        cache_key = f"text_translate:{hashlib.md5(request.text.encode()).hexdigest()}:{request.source_language}:{request.target_language}"
+        cache_key = f"text_translate:{xxhash.xxh3_128_hexdigest(request.text.encode())}:{request.source_language}:{request.target_language}"
         
         # Check cache
-        cached_result = redis_client.get(cache_key)
+        cached_result = await redis_client.get(cache_key)
         if cached_result:
-            return json.loads(cached_result)
+            return orjson.loads(cached_result)
         
         start_time = time.time()
         
-        # Translate text
-        result = translator.translate(
+        # Translate text in thread pool
+        loop = asyncio.get_event_loop()
+        translated_text = await loop.run_in_executor(
+            executor,
+            translate_text_sync,
             request.text,
-            src=request.source_language,
-            dest=request.target_language
+            request.source_language,
+            request.target_language
         )
         
         processing_time = time.time() - start_time
         
         response = {
-            "translated_text": result.text,
+            "translated_text": translated_text,
             "source_language": request.source_language,
             "target_language": request.target_language,
-            "detected_language": result.src,
+            "detected_language": request.source_language,
             "processing_time": processing_time
         }
         
         # Cache for 1 hour
-        redis_client.setex(cache_key, 3600, json.dumps(response))
+        cache_in_background(redis_client, {cache_key: orjson.dumps(response)})
         
         return response
         
@@ -277,27 +835,16 @@ async def detect_language(audio_file: UploadFile):
     if not audio_file:
         raise HTTPException(status_code=400, detail="No audio file provided")
     
-    content = await audio_file.read()
+    content_hash, is_mp4 = await hash_upload(audio_file)
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-        tmp_file.write(content)
-        tmp_file_path = tmp_file.name
+    # Use Whisper's language detection
+    audio = await _get_audio(content_hash, audio_file, is_mp4)
+    result = await run_whisper(audio, "transcribe")
     
-    try:
-        # Use Whisper's language detection
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            executor,
-            lambda: model.transcribe(tmp_file_path, language=None, task="transcribe", fp16=DEVICE == "cuda")
-        )
-        
-        return {
-            "detected_language": result["language"],
-            "text_preview": result["text"][:150] + "..." if len(result["text"]) > 100 else result["text"]
-        }
-        
-    finally:
-        os.unlink(tmp_file_path)
+    return {
+        "detected_language": result["detected_language"],
+        "text_preview": result["text"][:150] + "..." if len(result["text"]) > 100 else result["text"]
+    }
 
 @app.get("/health")
 async def health_check():
@@ -314,17 +861,18 @@ async def health_check():
 async def get_supported_languages():
     """Get supported languages"""
     return {
-        "input_languages": list(whisper.tokenizer.LANGUAGES.keys()),
-        "output_languages": ["en", "es", "fr", "de", "it", "pt", "ru", "ja", "ko", "zh", "ar", "hi", "and 100+ more"],  # Via text translation
+        "input_languages": model.supported_languages,
+        "output_languages": list(NLLB_LANGUAGE_CODES.keys()),  # Via text translation
         "note": "Whisper transcribes in all supported languages. Translation to English is native, other languages use text translation."
     }
 
-@app.post("/translate_audio_to_language", response_model=WhisperResponse)
+@app.post("/translate_audio_to_language", response_model=None, responses={200: {"model": WhisperResponse}})
 async def translate_audio_to_any_language(
     audio_file: UploadFile,
     source_language: Optional[str] = Form(None),
     target_language: str = Form("en"),
     return_segments: bool = Form(False),
+    segments_format: Literal["soa", "aos"] = Form("soa"),
     return_language: bool = Form(True)
 ):
     """Translate audio to any language using two-step process"""
@@ -332,56 +880,64 @@ async def translate_audio_to_any_language(
     if not audio_file:
         raise HTTPException(status_code=400, detail="No audio file provided")
     
+    check_translation_languages(None, target_language)
+    
     try:
         # Step 1: Transcribe audio to text
         transcription_request = TranscriptionRequest(
             source_language=source_language,
             task="transcribe",
             return_segments=return_segments,
+            segments_format=segments_format,
             return_language=return_language
         )
         
         transcription_result = await process_audio_async(audio_file, transcription_request)
+        transcript = transcription_result["text"]
+        detected_language = transcription_result["detected_language"]
         
         # Step 2: Translate the transcribed text (if target is not the source language)
-        if target_language != transcription_result.detected_language:
-            from googletrans import Translator
-            translator = Translator()
+        if target_language != detected_language:
+            check_translation_languages(detected_language, target_language)
             
             # Create cache key for the text translation step
-            cache_key = f"text_translate:{hashlib.md5(transcription_result.text.encode()).hexdigest()}:{transcription_result.detected_language}:{target_language}"
+            cache_key = f"text_translate:{xxhash.xxh3_128_hexdigest(transcript.encode())}:{detected_language}:{target_language}"
             
             # Check cache for text translation
-            cached_translation = redis_client.get(cache_key)
+            cached_translation = await redis_client.get(cache_key)
             if cached_translation:
-                translated_text = json.loads(cached_translation)["translated_text"]
+                translated_text = orjson.loads(cached_translation)["translated_text"]
             else:
-                # Translate the text
-                translation_result = translator.translate(
-                    transcription_result.text,
-                    src=transcription_result.detected_language,
-                    dest=target_language
+                # Translate the text in thread pool
+                loop = asyncio.get_event_loop()
+                translated_text = await loop.run_in_executor(
+                    executor,
+                    translate_text_sync,
+                    transcript,
+                    detected_language,
+                    target_language
                 )
-                translated_text = translation_result.text
                 
                 # Cache the text translation
-                redis_client.setex(cache_key, 3600, json.dumps({
+                cache_in_background(redis_client, {cache_key: orjson.dumps({
                     "translated_text": translated_text,
-                    "source_language": transcription_result.detected_language,
+                    "source_language": detected_language,
                     "target_language": target_language
-                }))
+                })})
         else:
             # Same language, no translation needed
-            translated_text = transcription_result.text
+            translated_text = transcript
         
         # Return combined result
-        return WhisperResponse(
-            text=translated_text,
-            detected_language=transcription_result.detected_language,
-            segments=transcription_result.segments,
-            processing_time=transcription_result.processing_time + 0.1,  # Add small overhead for translation
-            task="translate_to_language"
-        )
+        return ORJSONResponse({
+            **transcription_result,
+            "text": translated_text,
+            "processing_time": transcription_result["processing_time"] + 0.1,  # Add small overhead for translation
+            "task": "translate_to_language"
+        })
+        
+    except HTTPException:
+        raise
         
     except Exception as e:
         logging.error(f"Audio translation error: {str(e)}")
@@ -389,4 +945,12 @@ async def translate_audio_to_any_language(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, workers=1)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        workers=1,
+        loop="uvloop",
+        http="httptools",
+        access_log=False
+    )
\ No newline at end of file
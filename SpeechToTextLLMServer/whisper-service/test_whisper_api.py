@@ -13,12 +13,22 @@ import tempfile
 import wave
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # Configuration
 BASE_URL = "http://34.152.9.212"  # Replace with your actual URL
 TEST_AUDIO_FILE = "test_audio.wav"
 
+# Reuse pooled connections across tests instead of reconnecting per request
+session = requests.Session()
+session.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.1)
+))
+
 class Colors:
     GREEN = '\033[92m'
     RED = '\033[91m' 
@@ -46,9 +56,13 @@ def create_test_audio_file():
         # Generate a 3-second sine wave (440Hz - A note)
         duration = 3.0
         sample_rate = 16000
-        t = np.linspace(0, duration, int(sample_rate * duration), False)
-        audio_data = np.sin(440 * 2 * np.pi * t) * 0.3
-        audio_data = (audio_data * 32767).astype(np.int16)
+        num_samples = int(sample_rate * duration)
+        step = 2 * np.pi * 440 / sample_rate  # Phase advance per sample
+        audio_data = np.arange(num_samples, dtype=np.float32)
+        audio_data *= step
+        np.sin(audio_data, out=audio_data)
+        audio_data *= 0.3 * 32767
+        audio_data = audio_data.astype(np.int16)
         
         with wave.open(TEST_AUDIO_FILE, 'w') as wav_file:
             wav_file.setnchannels(1)  # Mono
@@ -66,7 +80,7 @@ def test_health_check():
     """Test /health endpoint"""
     try:
         start_time = time.time()
-        response = requests.get(f"{BASE_URL}/health", timeout=10)
+        response = session.get(f"{BASE_URL}/health", timeout=10)
         response_time = time.time() - start_time
         
         if response.status_code == 200:
@@ -85,7 +99,7 @@ def test_supported_languages():
     """Test /languages endpoint"""
     try:
         start_time = time.time()
-        response = requests.get(f"{BASE_URL}/languages", timeout=10)
+        response = session.get(f"{BASE_URL}/languages", timeout=10)
         response_time = time.time() - start_time
         
         if response.status_code == 200:
@@ -116,7 +130,7 @@ def test_transcribe_audio():
                 'return_segments': 'false',
                 'return_language': 'true'
             }
-            response = requests.post(f"{BASE_URL}/transcribe", files=files, data=data, timeout=60)
+            response = session.post(f"{BASE_URL}/transcribe", files=files, data=data, timeout=60)
         
         response_time = time.time() - start_time
         
@@ -148,7 +162,7 @@ def test_translate_to_english():
                 'return_segments': 'false',
                 'return_language': 'true'
             }
-            response = requests.post(f"{BASE_URL}/translate", files=files, data=data, timeout=60)
+            response = session.post(f"{BASE_URL}/translate", files=files, data=data, timeout=60)
         
         response_time = time.time() - start_time
         
@@ -180,7 +194,7 @@ def test_translate_audio_to_language():
                 'return_segments': 'false',
                 'return_language': 'true'
             }
-            response = requests.post(f"{BASE_URL}/translate_audio_to_language", files=files, data=data, timeout=60)
+            response = session.post(f"{BASE_URL}/translate_audio_to_language", files=files, data=data, timeout=60)
         
         response_time = time.time() - start_time
         
@@ -206,7 +220,7 @@ def test_detect_language():
         start_time = time.time()
         with open(TEST_AUDIO_FILE, 'rb') as f:
             files = {'audio_file': ('test.wav', f, 'audio/wav')}
-            response = requests.post(f"{BASE_URL}/detect_language", files=files, timeout=60)
+            response = session.post(f"{BASE_URL}/detect_language", files=files, timeout=60)
         
         response_time = time.time() - start_time
         
@@ -231,7 +245,7 @@ def test_translate_text():
             "source_language": "en",
             "target_language": "es"
         }
-        response = requests.post(f"{BASE_URL}/translate_text", json=payload, timeout=30)
+        response = session.post(f"{BASE_URL}/translate_text", json=payload, timeout=30)
         response_time = time.time() - start_time
         
         if response.status_code == 200:
@@ -253,7 +267,7 @@ def test_error_handling():
     
     # Test 1: No audio file
     try:
-        response = requests.post(f"{BASE_URL}/transcribe", timeout=10)
+        response = session.post(f"{BASE_URL}/transcribe", timeout=10)
         if response.status_code == 422:  # FastAPI validation error
             tests_passed += 1
             print(f"  {Colors.GREEN}✅{Colors.END} No audio file handled correctly")
@@ -268,7 +282,7 @@ def test_error_handling():
             with open(TEST_AUDIO_FILE, 'rb') as f:
                 files = {'audio_file': ('test.wav', f, 'audio/wav')}
                 data = {'target_language': 'fr'}  # Should fail for /translate
-                response = requests.post(f"{BASE_URL}/translate", files=files, data=data, timeout=30)
+                response = session.post(f"{BASE_URL}/translate", files=files, data=data, timeout=30)
             
             if response.status_code == 400:
                 tests_passed += 1
@@ -281,7 +295,7 @@ def test_error_handling():
     # Test 3: Empty text translation
     try:
         payload = {"text": "", "source_language": "en", "target_language": "es"}
-        response = requests.post(f"{BASE_URL}/translate_text", json=payload, timeout=10)
+        response = session.post(f"{BASE_URL}/translate_text", json=payload, timeout=10)
         if response.status_code in [400, 422, 500]:  # Should handle empty text
             tests_passed += 1
             print(f"  {Colors.GREEN}✅{Colors.END} Empty text handled correctly")
@@ -6,6 +6,7 @@ export interface WhisperResponse {
   text: string;
   detected_language?: string;
   segments?: any[];
+  segments_soa?: Record<string, any[]>;
   processing_time: number;
   task: string;
 }